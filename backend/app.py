@@ -1,18 +1,71 @@
-import json
 import sqlite3
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
+import hashlib
 import os
 import re
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from collections import OrderedDict
+import ahocorasick
+import orjson
 
 # --- DB Setup (Bonus 4a: SQLite) ---
 DATABASE = 'reports.db'
 
+# One shared write connection per process instead of a connect() per request.
+# It runs in autocommit mode (isolation_level=None) and is guarded by a lock,
+# since sqlite3 connections must not be used by two threads at the same time.
+# Reads borrow a connection from a small pool instead, so a long /reports
+# stream never holds the write lock. All connections are opened lazily so
+# none are inherited across a fork.
+_db_conn = None
+db_lock = threading.Lock()
+_read_pool = queue.SimpleQueue()
+
+def _connect():
+    """Opens a tuned SQLite connection that may be handed between threads."""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # Per-connection tuning; journal_mode=WAL itself is persisted in the file by init_db()
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    # Checkpoint the WAL every ~10k pages rather than the default 1000, so bursts of
+    # writes are not interrupted by frequent checkpoints; ~20MB page cache per connection
+    conn.execute("PRAGMA wal_autocheckpoint=10000")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+def get_db():
+    """Returns the shared write connection, opening it on first use. Call with db_lock held."""
+    global _db_conn
+    if _db_conn is None:
+        _db_conn = _connect()
+    return _db_conn
+
+@contextmanager
+def read_db():
+    """Borrows a read connection from the pool for the duration of the block."""
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+    finally:
+        _read_pool.put(conn)
+
 def init_db():
     """Initializes the SQLite database table for reports."""
-    with sqlite3.connect(DATABASE) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
+    conn = sqlite3.connect(DATABASE)
+    try:
+        # WAL lets /reports read while a report is being written
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS reports (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 raw_report TEXT NOT NULL,
@@ -23,30 +76,66 @@ def init_db():
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # /reports now orders by id (the rowid), so this index only cost writes
+        conn.execute("DROP INDEX IF EXISTS idx_reports_ts")
         conn.commit()
+    finally:
+        conn.close()
 
-def save_report(raw_report, data):
-    """Saves the processed report data to the SQLite database."""
-    with sqlite3.connect(DATABASE) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO reports (raw_report, drug, adverse_events, severity, outcome) VALUES (?, ?, ?, ?, ?)",
-            (
-                raw_report, 
-                data['drug'], 
-                json.dumps(data['adverse_events']),
-                data['severity'], 
-                data['outcome']
-            )
+# Kept as one constant so every insert uses identical SQL text and hits the
+# sqlite3 module's per-connection prepared statement cache
+INSERT_SQL = "INSERT INTO reports (raw_report, drug, adverse_events, severity, outcome) VALUES (?, ?, ?, ?, ?)"
+
+def save_reports(reports):
+    """Saves a batch of (raw_report, data) pairs in a single transaction."""
+    rows = [
+        (
+            raw_report, 
+            data['drug'], 
+            orjson.dumps(data['adverse_events']).decode(),
+            data['severity'], 
+            data['outcome']
         )
-        conn.commit()
+        for raw_report, data in reports
+    ]
+    with db_lock:
+        conn = get_db()
+        # Autocommit would otherwise commit (and sync) once per row
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(INSERT_SQL, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            # Never leave the shared connection inside a transaction (a failed COMMIT can),
+            # or every later BEGIN fails. Only roll back if one is still open, so a
+            # ROLLBACK error cannot mask the original one.
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
 
 # Initialize the database on startup
 init_db()
 
 
 # --- Flask & Initialization ---
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.json)."""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Configure CORS dynamically for deployment (Render, Vercel, etc.)
 # FALLBACK: Use local URL for development (http://localhost:3000)
@@ -62,11 +151,20 @@ else:
 # Initialize CORS with the dynamic list of allowed origins
 CORS(app, resources={r"/*": {"origins": origins_list}})
 
+# gzip/brotli-compress responses for clients that accept it (mostly helps /reports)
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'application/x-ndjson']
+Compress(app)
+
 
 # --- Core Extraction Logic (PURE RULE-BASED) ---
 
 # Expanded lists for more accurate rule-based matching
-DRUG_PATTERNS = r'(?:taking|took|given|administered|started|gave)\s+([A-Z]\w+)\s*(?:[A-Z]\w*)*|Drug\s+[A-Z]'
+# 'Drug X' or a capitalized word after a drug verb (e.g. 'taking Panadol', 'was given Aspirin'),
+# whichever comes first. The verb branch skips 'Drug X' so 'given Drug B' still yields 'Drug B'.
+DRUG_RE = re.compile(
+    r'Drug\s+(?P<x>[A-Z])'
+    r'|(?:taking|took|given|administered|started|gave)\s+(?!Drug\s+[A-Z])(?P<verb>[A-Z]\w+)'
+)
 SYMPTOMS_LIST = [
     "nausea", "headache", "vomiting", "fever", "rash", "dizziness", "vertigo", 
     "fatigue", "diarrhea", "pain", "swelling", "bleeding", "seizure", "insomnia", 
@@ -83,64 +181,170 @@ OUTCOME_KEYWORDS = {
     "fatal": ["fatal", "died", "death"]
 }
 
+# Inflected/derived forms that whole-word matching would otherwise miss. Each form is
+# registered in the automaton under the level of the keyword it derives from.
+KEYWORD_FORMS = {
+    # symptoms (plurals, plus adjectives reporters use in place of the noun)
+    "nausea": ["nauseated", "nauseous"],
+    "headache": ["headaches"],
+    "fever": ["fevers", "feverish"],
+    "rash": ["rashes"],
+    "fatigue": ["fatigued"],
+    "pain": ["pains"],
+    "seizure": ["seizures"],
+    "stomach ache": ["stomach aches"],
+    "cramps": ["cramp"],
+    # severity
+    "severe": ["severely"],
+    "critical": ["critically"],
+    "serious": ["seriously"],
+    "moderate": ["moderately"],
+    "significant": ["significantly"],
+    "mild": ["mildly"],
+    "slight": ["slightly"],
+    "minimal": ["minimally"],
+    # outcome
+    "fatal": ["fatally", "fatality", "fatalities"],
+    "death": ["deaths"],
+}
 
-def extract_report_data(report_text):
+def _keyword_forms(keyword):
+    """The keyword itself plus any extra forms registered for it in KEYWORD_FORMS."""
+    return (keyword, *KEYWORD_FORMS.get(keyword, ()))
+
+# All keywords in one Aho-Corasick automaton, each tagged with (category, level, keyword length),
+# so a single pass over the report finds every symptom, severity and outcome keyword
+KEYWORD_AUTOMATON = ahocorasick.Automaton()
+for symptom in SYMPTOMS_LIST:
+    for form in _keyword_forms(symptom):
+        KEYWORD_AUTOMATON.add_word(form, ("ae", symptom, len(form)))
+for level, keywords in SEVERITY_KEYWORDS.items():
+    for kw in keywords:
+        for form in _keyword_forms(kw):
+            KEYWORD_AUTOMATON.add_word(form, ("severity", level, len(form)))
+for level, keywords in OUTCOME_KEYWORDS.items():
+    for kw in keywords:
+        for form in _keyword_forms(kw):
+            KEYWORD_AUTOMATON.add_word(form, ("outcome", level, len(form)))
+KEYWORD_AUTOMATON.make_automaton()
+
+# Display form of every severity/outcome level, built once instead of .title() per request
+LEVEL_DISPLAY = {level: level.title() for level in [*SEVERITY_KEYWORDS, *OUTCOME_KEYWORDS, "unknown"]}
+
+
+def _is_whole_word(text, start, end):
+    """True if text[start:end] is not glued to letters/digits on either side."""
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+def _extract_report_data(report_text):
     """
     Extracts structured data using only REGEX and simple keyword matching.
     """
     report_lower = report_text.lower()
     
     drug = "Unknown Drug"
-    adverse_events = []
-    severity = "unknown"
-    outcome = "unknown"
     
     # 1. Drug Extraction (REGEX)
-    
-    # Check for 'Drug X' pattern
-    drug_match_x = re.search(r'Drug\s+([A-Z])', report_text)
-    if drug_match_x:
-        drug = f"Drug {drug_match_x.group(1)}"
-    else:
-        # Look for a capitalized word following key drug verbs (e.g., 'taking Panadol', 'given Aspirin')
-        drug_match_cap = re.search(r'(?:taking|took|given|administered|started|gave)\s+([A-Z]\w+)\s*(?:[A-Z]\w*)*', report_text)
-        if drug_match_cap:
-            drug = drug_match_cap.group(1)
-        
-        # Fallback: Look for capitalized word preceded by 'was given' (crude passive voice check)
-        elif 'was given' in report_lower:
-            # Look for an uppercase word immediately following 'was given'
-            passive_match = re.search(r'was\s+given\s+([A-Z]\w+)', report_text)
-            if passive_match:
-                drug = passive_match.group(1)
-
-    # 2. Adverse Events (Keyword Matching)
-    adverse_events = sorted(list(set(
-        symptom for symptom in SYMPTOMS_LIST 
-        if symptom in report_lower
-    )))
+    drug_match = DRUG_RE.search(report_text)
+    if drug_match:
+        if drug_match.lastgroup == "x":
+            drug = f"Drug {drug_match.group('x')}"
+        else:
+            drug = drug_match.group('verb')
+
+    # 2-4. Keyword Matching (one pass over the text collects every hit)
+    hits = set()
+    for end, (category, level, length) in KEYWORD_AUTOMATON.iter(report_lower):
+        tag = (category, level)
+        # Already recorded (e.g. a repeated keyword): nothing left to check for this slot
+        if tag in hits:
+            continue
+        # Keywords must be whole words ('low' must not match 'slowly', nor 'pain' match 'painful')
+        if not _is_whole_word(report_lower, end - length + 1, end + 1):
+            continue
+        hits.add(tag)
+
+    # 2. Adverse Events
+    adverse_events = sorted(level for category, level in hits if category == "ae")
     adverse_events = adverse_events if adverse_events else ["N/A"]
     
-    # 3. Severity Extraction (Keyword Matching)
-    for level, keywords in SEVERITY_KEYWORDS.items():
-        if any(kw in report_lower for kw in keywords):
-            severity = level
-            break
+    # 3. Severity (first level in SEVERITY_KEYWORDS order wins)
+    severity = next((level for level in SEVERITY_KEYWORDS if ("severity", level) in hits), "unknown")
 
-    # 4. Outcome Extraction (Keyword Matching)
-    for level, keywords in OUTCOME_KEYWORDS.items():
-        if any(kw in report_lower for kw in keywords):
-            outcome = level
-            break
+    # 4. Outcome (first level in OUTCOME_KEYWORDS order wins)
+    outcome = next((level for level in OUTCOME_KEYWORDS if ("outcome", level) in hits), "unknown")
             
     # Final formatting
     return {
         "drug": drug.title() if drug != "Unknown Drug" and not drug.isupper() else drug,
         "adverse_events": adverse_events,
-        "severity": severity.title(),
-        "outcome": outcome.title()
+        "severity": LEVEL_DISPLAY[severity],
+        "outcome": LEVEL_DISPLAY[outcome]
     }
+
+# Resubmitted reports (retries, copy-pasted boilerplate) skip extraction entirely.
+# LRU keyed by a 16-byte digest of the text, so the cache never holds report bodies.
+EXTRACT_CACHE_SIZE = 4096
+_extract_cache = OrderedDict()
+_extract_cache_lock = threading.Lock()
+_extract_cache_stats = {"hits": 0, "misses": 0}
+
+def extract_report_data(report_text):
+    """Returns the (cached) extraction result for a report as a fresh dict."""
+    key = hashlib.blake2b(report_text.encode(), digest_size=16).digest()
+    with _extract_cache_lock:
+        data = _extract_cache.get(key)
+        if data is not None:
+            _extract_cache.move_to_end(key)
+            _extract_cache_stats["hits"] += 1
+
+    if data is None:
+        data = _extract_report_data(report_text)
+        with _extract_cache_lock:
+            _extract_cache_stats["misses"] += 1
+            _extract_cache[key] = data
+            if len(_extract_cache) > EXTRACT_CACHE_SIZE:
+                _extract_cache.popitem(last=False)
+
+    # Copy so callers never mutate the cached entry
+    return {**data, "adverse_events": list(data["adverse_events"])}
     
+# --- Deferred Report Writes ---
+# /process-report responds as soon as extraction is done. Reports are queued and a
+# single writer thread (one writer suits SQLite) saves everything queued since its
+# last run in one save_reports() transaction, so bursts are written as a batch.
+_pending_reports = queue.SimpleQueue()
+writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report-writer')
+
+def _flush_pending_reports():
+    """Saves all currently queued reports in a single transaction."""
+    batch = []
+    while True:
+        try:
+            batch.append(_pending_reports.get_nowait())
+        except queue.Empty:
+            break
+    if not batch:
+        return  # An earlier flush already picked these up
+    # The clients already got their 200, so retry once before giving the batch up
+    for attempt in (1, 2):
+        try:
+            save_reports(batch)
+            return
+        except Exception as e:
+            if attempt == 1:
+                app.logger.warning(f"Saving {len(batch)} report(s) failed, retrying: {e}")
+            else:
+                # Log sizes only; report text may contain patient details
+                lengths = [len(raw_report) for raw_report, _ in batch]
+                app.logger.error(f"Dropped {len(batch)} report(s) after retry (report lengths: {lengths}): {e}")
+
+def queue_report(raw_report, data):
+    """Schedules a processed report to be saved after the response is sent."""
+    _pending_reports.put((raw_report, data))
+    writer_pool.submit(_flush_pending_reports)
+
 # --- API Endpoint: POST /process-report ---
 @app.route('/process-report', methods=['POST'])
 def process_report():
@@ -151,35 +355,81 @@ def process_report():
     
     try:
         processed_data = extract_report_data(report_text)
-        save_report(report_text, processed_data)
+        queue_report(report_text, processed_data)
         return jsonify(processed_data), 200
     except Exception as e:
         app.logger.error(f"Processing error: {e}")
         return jsonify({"error": "Internal processing error"}), 500
 
 # --- BONUS API Endpoint: GET /reports (History) ---
+REPORTS_QUERY = (
+    "SELECT id, raw_report, drug, adverse_events, severity, outcome, timestamp "
+    # id is AUTOINCREMENT, so it follows insert order even when a batch of reports
+    # shares one CURRENT_TIMESTAMP second; SQLite reads it straight off the rowid
+    "FROM reports ORDER BY id DESC LIMIT ? OFFSET ?"
+)
+
+def _non_negative_int_arg(name, default):
+    """Parses an optional non-negative integer query param; None if it is malformed."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not (value.isascii() and value.isdigit()):
+        return None
+    return int(value)
+
+def _report_row_to_dict(row):
+    """Converts a reports row into the API representation."""
+    report_dict = dict(row)
+    # Deserialize JSON string back to list for adverse_events
+    try:
+        report_dict['adverse_events'] = orjson.loads(report_dict['adverse_events'])
+    except orjson.JSONDecodeError:
+        report_dict['adverse_events'] = ["N/A"]
+    return report_dict
+
 @app.route('/reports', methods=['GET'])
 def get_reports():
-    """Fetches all past reports from the SQLite database."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row 
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, raw_report, drug, adverse_events, severity, outcome, timestamp FROM reports ORDER BY timestamp DESC")
-    reports = cursor.fetchall()
-    conn.close()
-
-    reports_list = []
-    for report in reports:
-        report_dict = dict(report)
-        # Deserialize JSON string back to list for adverse_events
-        try:
-             report_dict['adverse_events'] = json.loads(report_dict['adverse_events'])
-        except (json.JSONDecodeError, TypeError):
-             report_dict['adverse_events'] = ["N/A"]
-             
-        reports_list.append(report_dict)
+    """
+    Fetches past reports from the SQLite database, newest first.
+    Optional query params: 'limit'/'offset' for paging, and 'format=ndjson'
+    to stream one JSON object per line instead of returning a single array.
+    """
+    limit = _non_negative_int_arg('limit', -1)  # SQLite treats a negative LIMIT as no limit
+    offset = _non_negative_int_arg('offset', 0)
+    if limit is None or offset is None:
+        return jsonify({"error": "'limit' and 'offset' must be non-negative integers"}), 400
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            # Rows are read from the cursor as they are sent: constant memory, fast first byte
+            with read_db() as conn, closing(conn.execute(REPORTS_QUERY, (limit, offset))) as cursor:
+                for row in cursor:
+                    yield orjson.dumps(_report_row_to_dict(row)) + b'\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    with read_db() as conn, closing(conn.execute(REPORTS_QUERY, (limit, offset))) as cursor:
+        reports_list = [_report_row_to_dict(row) for row in cursor]
 
-    return jsonify(reports_list), 200
+    response = jsonify(reports_list)
+    # Content-hash ETag lets the frontend revalidate and get an empty 304 when nothing changed.
+    # no-cache (always revalidate) because a just-submitted report is written after its response.
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=8).hexdigest(), weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# --- Debug API Endpoint: GET /debug/cache-stats ---
+# Only served in debug mode or when ENABLE_DEBUG_ENDPOINTS=1 is set
+@app.route('/debug/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Reports hit/miss counts of the extraction cache."""
+    if not (app.debug or os.environ.get('ENABLE_DEBUG_ENDPOINTS') == '1'):
+        return jsonify({"error": "Not found"}), 404
+
+    with _extract_cache_lock:
+        stats = {**_extract_cache_stats, "currsize": len(_extract_cache), "maxsize": EXTRACT_CACHE_SIZE}
+    return jsonify(stats), 200
 
 # --- BONUS API Endpoint: POST /translate ---
 TRANSLATION_DICT = {
@@ -192,6 +442,8 @@ TRANSLATION_DICT = {
     "Mild": {"fr": "Léger", "sw": "Kidogo"},
     "Moderate": {"fr": "Modéré", "sw": "Wastani"},
 }
+# Lowercase lookup keys -> (display name, translations), so a request needs one .lower()
+TRANSLATION_LC = {name.lower(): (name, translations) for name, translations in TRANSLATION_DICT.items()}
 
 @app.route('/translate', methods=['POST'])
 def translate_outcome():
@@ -199,13 +451,19 @@ def translate_outcome():
     if not request.json or 'outcome' not in request.json or 'language' not in request.json:
         return jsonify({"error": "Missing 'outcome' or 'language' field in request"}), 400
 
-    outcome = request.json['outcome'].title()
+    outcome = request.json['outcome']
     language = request.json['language'].lower()
 
     if language not in ['fr', 'sw']:
          return jsonify({"error": "Language must be 'fr' (French) or 'sw' (Swahili)"}), 400
 
-    translation = TRANSLATION_DICT.get(outcome, {}).get(language, "Translation N/A")
+    entry = TRANSLATION_LC.get(outcome.lower())
+    if entry:
+        outcome, translations = entry
+        translation = translations.get(language, "Translation N/A")
+    else:
+        outcome = outcome.title()
+        translation = "Translation N/A"
     
     return jsonify({"original": outcome, "language": language, "translation": translation}), 200
 
@@ -213,4 +471,5 @@ def translate_outcome():
 # Run the app
 if __name__ == '__main__':
     # Use host='0.0.0.0' for deployment/docker compatibility
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # threaded=True so concurrent requests are served in parallel threads
+    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,12 @@
+# Gunicorn settings for deployment (used by the Procfile)
+import multiprocessing
+import os
+
+# Import app.py once in the master before forking, so workers share the
+# compiled regexes, keyword automaton and other module-level state
+# copy-on-write instead of each rebuilding them. This is safe because app.py
+# opens no SQLite connections and starts no threads at import time.
+preload_app = True
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))